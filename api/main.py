@@ -1,10 +1,20 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from api.routes.file_routes import router as file_router
+from api.warmup import preload_enabled, start_background_preload
 import os
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Heavy data libraries are imported lazily; optionally warm them up in the background
+    if preload_enabled():
+        start_background_preload()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(file_router, prefix="/files")
 
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import List
-from api.services.merge_service import process_files
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, Body, Request, BackgroundTasks, HTTPException
+from typing import List, Optional
+from api.utils.export import OUTPUT_FORMATS, MEDIA_TYPES, iter_csv
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import os
+import uuid
+import shutil
+import zipfile
 
 router = APIRouter()
 
@@ -12,7 +16,18 @@ UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 @router.post("/upload/")
-async def upload_files(excel_file: UploadFile = File(...), txt_files: List[UploadFile] = File(...)):
+async def upload_files(
+    background_tasks: BackgroundTasks,
+    excel_file: UploadFile = File(...),
+    txt_files: List[UploadFile] = File(...),
+    output_format: str = Form("xlsx"),
+    include_unmatched: bool = Form(True),
+    part: Optional[str] = Form(None),
+):
+    output_format = output_format.lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid output format. Use one of: {', '.join(OUTPUT_FORMATS)}.")
+
     # Validate excel
     if not (excel_file.filename.endswith(".xlsx") or excel_file.filename.endswith(".xls")):
         raise HTTPException(status_code=400, detail="Invalid Excel file format. Only .xlsx and .xls files are allowed.")
@@ -35,8 +50,50 @@ async def upload_files(excel_file: UploadFile = File(...), txt_files: List[Uploa
             f.write(await t.read())
         txt_paths.append(path)
 
+    # Parse each TXT once; the merge and the history store share the result
+    from api.utils.merge_data import load_report
+
     try:
-        output_path = process_files(excel_path, txt_paths)
+        reports, measurement_maps = [], []
+        for path in txt_paths:
+            report, mmap = load_report(path)
+            reports.append(report)
+            measurement_maps.append(mmap)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing files: {str(e)}")
+
+    response = _merged_response(excel_path, txt_paths, output_format, include_unmatched, measurement_maps)
+    _record_history(background_tasks, txt_paths, part, excel_file.filename, reports=reports)
+    return response
+
+
+def _record_history(background_tasks, txt_paths, part, template_name, txt_names=None, reports=None):
+    """Append the merged TXT files to the history store after the response has been sent.
+
+    Without an explicit part, the REPORT folder is resolved from the template and TXT names.
+    reports holds the already parsed TXT files, so they are not read again.
+    """
+    from api.utils.history_store import record_files
+
+    background_tasks.add_task(record_files, list(txt_paths), part, template_name, txt_names, reports)
+
+
+def _merged_response(excel_path, txt_paths, output_format, include_unmatched, measurement_maps=None):
+    """Run the merge and return the result in the requested format."""
+    # Imported on first use: pulls in pandas/numpy/openpyxl, which would otherwise slow app startup
+    from api.services.merge_service import process_files, build_merged_table
+
+    try:
+        if output_format == "csv":
+            # Stream CSV straight from the merged table; no workbook is built or written
+            merged_df = build_merged_table(excel_path, txt_paths, measurement_maps)
+            return StreamingResponse(
+                iter_csv(merged_df),
+                media_type=MEDIA_TYPES["csv"],
+                headers={"Content-Disposition": 'attachment; filename="merged_output.csv"'}
+            )
+
+        output_path = process_files(excel_path, txt_paths, output_format, include_unmatched, measurement_maps)
         
         # Verify file exists before sending response
         if not os.path.exists(output_path):
@@ -45,13 +102,189 @@ async def upload_files(excel_file: UploadFile = File(...), txt_files: List[Uploa
                 detail="Output file was not generated successfully"
             )
             
+        ext = os.path.splitext(output_path)[1].lstrip(".")
         return FileResponse(
             output_path, 
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename="merged_output.xlsx"
+            media_type=MEDIA_TYPES[ext],
+            filename=f"merged_output.{ext}"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error processing files: {str(e)}"
         )
+
+
+@router.post("/bulk")
+async def bulk_upload(archive: UploadFile = File(...), output_format: str = Form("xlsx")):
+    """Process many parts in one request.
+
+    The ZIP holds one folder per part (template + TXT files, like REPORT/<part>/) or a
+    manifest.json. Parts run concurrently and the result ZIP is streamed back as they finish;
+    per-part failures are reported in the result's manifest.json.
+    """
+    output_format = output_format.lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid output format. Use one of: {', '.join(OUTPUT_FORMATS)}.")
+    if not archive.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="Invalid archive format. Only .zip files are allowed.")
+
+    from api.services.bulk_service import safe_extract, discover_parts, stream_bulk_zip
+
+    work_dir = os.path.join(UPLOAD_DIR, f"bulk_{uuid.uuid4().hex}")
+    input_dir = os.path.join(work_dir, "input")
+    os.makedirs(input_dir, exist_ok=True)
+    zip_path = os.path.join(work_dir, "upload.zip")
+    try:
+        with open(zip_path, "wb") as f:
+            while chunk := await archive.read(1024 * 1024):
+                f.write(chunk)
+        # Extraction and discovery touch every member; keep them off the event loop
+        await run_in_threadpool(safe_extract, zip_path, input_dir)
+        parts = await run_in_threadpool(discover_parts, input_dir)
+    except (zipfile.BadZipFile, ValueError, KeyError) as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=f"Invalid bulk archive: {str(e)}")
+    if not parts:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail="No parts found: expected folders with an Excel template and TXT files, or a manifest.json.")
+
+    return StreamingResponse(
+        stream_bulk_zip(parts, work_dir, output_format),
+        media_type=MEDIA_TYPES["zip"],
+        headers={"Content-Disposition": 'attachment; filename="bulk_output.zip"'}
+    )
+
+
+# Resumable chunked uploads: create a session, PUT each file in chunks (any order across files,
+# sequential offsets within a file), then finalise. TXT files are parsed as soon as they complete.
+
+def _session_error(e):
+    from api.services.upload_service import UnknownSession, OffsetMismatch
+
+    if isinstance(e, UnknownSession):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, OffsetMismatch):
+        return HTTPException(status_code=409, detail={"message": str(e), "expected_offset": e.expected})
+    return HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/sessions")
+def create_upload_session(payload: dict = Body(...)):
+    """Start a resumable upload. Body: {"files": [{"name": ..., "size": ...}, ...]}."""
+    from api.services.upload_service import create_session, UploadSessionError
+
+    try:
+        return create_session(payload.get("files", []))
+    except UploadSessionError as e:
+        raise _session_error(e)
+
+
+@router.get("/sessions/{upload_id}")
+def get_upload_session(upload_id: str):
+    """Bytes received per file; clients resume each file from its 'received' offset."""
+    from api.services.upload_service import session_status, UploadSessionError
+
+    try:
+        return session_status(upload_id)
+    except UploadSessionError as e:
+        raise _session_error(e)
+
+
+@router.put("/sessions/{upload_id}/files/{index}")
+async def put_upload_chunk(upload_id: str, index: int, offset: int, request: Request, background_tasks: BackgroundTasks):
+    """Append the request body to file index at offset (must equal the bytes already received)."""
+    from api.services.upload_service import write_chunk, parse_completed_file, UploadSessionError
+
+    data = await request.body()
+    try:
+        status = write_chunk(upload_id, index, offset, data)
+    except UploadSessionError as e:
+        raise _session_error(e)
+    if status["complete"] and status["kind"] == "txt":
+        # Parse now, while the remaining files are still uploading
+        background_tasks.add_task(parse_completed_file, upload_id, index)
+    return status
+
+
+@router.post("/sessions/{upload_id}/finalize")
+def finalize_upload_session(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    output_format: str = Form("xlsx"),
+    include_unmatched: bool = Form(True),
+    part: Optional[str] = Form(None),
+):
+    """Merge a fully uploaded session and return the result like /upload/."""
+    from api.services.upload_service import session_inputs, discard_session, UploadSessionError
+
+    output_format = output_format.lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid output format. Use one of: {', '.join(OUTPUT_FORMATS)}.")
+    try:
+        excel_path, txt_paths, measurement_maps, reports = session_inputs(upload_id)
+    except UploadSessionError as e:
+        raise _session_error(e)
+    response = _merged_response(excel_path, txt_paths, output_format, include_unmatched, measurement_maps)
+    # Stored names carry an index prefix ("0000_302.xlsx"); drop it before matching REPORT folders
+    excel_name, *txt_names = [os.path.basename(p).split("_", 1)[-1] for p in [excel_path] + txt_paths]
+    _record_history(background_tasks, txt_paths, part, excel_name, txt_names, reports)
+    # Runs after the history task above, which still hashes the session's TXT files
+    background_tasks.add_task(discard_session, upload_id)
+    return response
+
+
+# Historical measurements recorded from every merge (and the TXT/ backfill)
+
+def _history_conn():
+    from api.utils.history_store import connect, history_enabled
+
+    if not history_enabled():
+        raise HTTPException(status_code=404, detail="History store is disabled.")
+    return connect()
+
+
+@router.get("/history")
+def get_history(
+    part: str,
+    dim: Optional[int] = None,
+    axis: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = 500,
+):
+    """Measurements of a part (optionally one Print No / axis), newest first. since/until are ISO dates."""
+    from api.utils.history_store import query_history
+
+    conn = _history_conn()
+    try:
+        records = query_history(conn, part, dim=dim, axis=axis, since=since, until=until, limit=max(1, min(limit, 100000)))
+    finally:
+        conn.close()
+    return {"part": part, "dim": dim, "count": len(records), "records": records}
+
+
+@router.get("/history/parts")
+def get_history_parts():
+    """Parts in the history store with run counts."""
+    from api.utils.history_store import list_parts
+
+    conn = _history_conn()
+    try:
+        return {"parts": list_parts(conn)}
+    finally:
+        conn.close()
+
+
+@router.get("/history/dims")
+def get_history_dims(part: str):
+    """Dimensions recorded for a part with sample counts."""
+    from api.utils.history_store import list_dimensions
+
+    conn = _history_conn()
+    try:
+        return {"part": part, "dims": list_dimensions(conn, part)}
+    finally:
+        conn.close()
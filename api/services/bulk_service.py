@@ -0,0 +1,209 @@
+import io
+import os
+import json
+import shutil
+import logging
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TEMPLATE_EXTENSIONS = (".xlsx", ".xls")
+TXT_EXTENSIONS = (".txt",)
+MANIFEST_NAME = "manifest.json"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all bulk requests of this worker (created on first use).
+
+    Children are started through forkserver (spawn where unavailable): forking the running,
+    multi-threaded uvicorn worker could copy locks held by other threads and deadlock.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get("CONVERSION_BULK_WORKERS", "0")) or None
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def safe_extract(zip_path: str, dest_dir: str) -> None:
+    """Extract zip_path into dest_dir, refusing members that would escape it."""
+    dest_root = os.path.realpath(dest_dir)
+    with zipfile.ZipFile(zip_path) as zf:
+        for member in zf.infolist():
+            target = os.path.realpath(os.path.join(dest_root, member.filename))
+            if target != dest_root and not target.startswith(dest_root + os.sep):
+                raise ValueError(f"Unsafe path in ZIP: {member.filename}")
+        zf.extractall(dest_root)
+
+
+def _inside(root: str, rel_path: str) -> str:
+    """Resolve a manifest path relative to root, rejecting anything outside it."""
+    path = os.path.realpath(os.path.join(root, rel_path))
+    if not path.startswith(root + os.sep):
+        raise ValueError(f"Manifest path outside the archive: {rel_path}")
+    return path
+
+
+def discover_parts(root: str) -> List[Dict]:
+    """Find the parts to process in an extracted bulk upload.
+
+    With a manifest.json at the root ({"parts": [{"name", "template", "txt_files"}]}) paths are
+    taken from it, relative to the root. Otherwise every folder holding an Excel template is a
+    part (REPORT/<part>/ layout), with the TXT files in that same folder.
+    """
+    root = os.path.realpath(root)
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        entries = manifest.get("parts", []) if isinstance(manifest, dict) else None
+        if not isinstance(entries, list):
+            raise ValueError("manifest.json must hold {\"parts\": [...]}")
+        parts = []
+        for entry in entries:
+            txt_files = entry.get("txt_files", []) if isinstance(entry, dict) else None
+            if (not isinstance(txt_files, list) or not isinstance(entry.get("name"), str)
+                    or not isinstance(entry.get("template"), str) or not all(isinstance(p, str) for p in txt_files)):
+                raise ValueError(f"Invalid manifest entry (expected name, template and txt_files strings): {entry!r}")
+            parts.append({
+                "name": entry["name"],
+                "template": _inside(root, entry["template"]),
+                "txt_files": [_inside(root, p) for p in txt_files],
+            })
+        return parts
+
+    parts = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        templates = sorted(f for f in filenames if f.lower().endswith(TEMPLATE_EXTENSIONS) and not f.startswith("~$"))
+        if not templates:
+            continue
+        parts.append({
+            "name": os.path.relpath(dirpath, root).replace(os.sep, "/"),
+            "template": os.path.join(dirpath, templates[0]),
+            "txt_files": sorted(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(TXT_EXTENSIONS)),
+        })
+    return parts
+
+
+def run_part(part: Dict, output_dir: str, output_format: str = "xlsx") -> Dict:
+    """Run final_data for one part into its own output_dir; never raises, errors are returned in the manifest entry."""
+    from api.utils.merge_data import final_data, load_report
+    from api.utils.export import expand_formats
+    from api.utils.history_store import record_files
+
+    entry = {"part": part["name"], "template": os.path.basename(part["template"]),
+             "txt_files": [os.path.basename(p) for p in part["txt_files"]]}
+    try:
+        if not part["txt_files"]:
+            raise ValueError("No TXT files found for this part")
+        # A directory per part: part names ('a/b', 'a_b') need not map to distinct file names
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, "merged_output.xlsx")
+        # Parse each TXT once; the merge and the history store share the result
+        reports, measurement_maps = zip(*(load_report(p) for p in part["txt_files"]))
+        outputs = final_data(part["template"], part["txt_files"], output_path, output_format=output_format,
+                             measurement_maps=measurement_maps)
+        missing = [fmt for fmt in expand_formats(output_format) if fmt not in outputs]
+        if missing:
+            raise RuntimeError(f"Output not generated for: {', '.join(missing)}")
+        entry.update(status="ok", outputs=outputs)
+        record_files(part["txt_files"], part["name"], os.path.basename(part["template"]), reports=list(reports))
+    except Exception as e:
+        logging.error(f"Bulk part {part['name']} failed: {str(e)}")
+        entry.update(status="error", error=str(e))
+    return entry
+
+
+def _remove_when_finished(futures, work_dir):
+    """Cancel parts that have not started and remove work_dir once the running ones are done.
+
+    Does not block: when the client disconnects mid-stream, running parts are still writing
+    into work_dir, so the last of them to finish removes it.
+    """
+    running = [f for f in futures if not f.cancel() and not f.done()]
+    if not running:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return
+    remaining = [len(running)]
+    lock = threading.Lock()
+
+    def part_done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            logging.info(f"Removed {work_dir} after its remaining parts finished")
+
+    for f in running:
+        f.add_done_callback(part_done)
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, non-seekable sink for zipfile; drain() hands back what was written so far."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_bulk_zip(parts: List[Dict], work_dir: str, output_format: str = "xlsx") -> Iterator[bytes]:
+    """Run every part concurrently and yield the result ZIP incrementally as parts finish.
+
+    Each finished part's outputs are added as <part>/<file> and flushed to the client straight
+    away; a manifest.json with one entry per part (status, outputs or error) closes the archive.
+    work_dir is removed once the archive is complete, or once the parts still running when the
+    client disconnected have finished.
+    """
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+    sink = _ZipStream()
+    manifest = []
+    futures = {}
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            pool = _get_pool()
+            futures.update(
+                (pool.submit(run_part, part, os.path.join(output_dir, f"{i:04d}"), output_format), part)
+                for i, part in enumerate(parts)
+            )
+            for future in as_completed(futures):
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    # e.g. a crashed pool process; report it like any other part failure
+                    entry = {"part": futures[future]["name"], "status": "error", "error": str(e)}
+                for fmt, path in entry.get("outputs", {}).items():
+                    arcname = f"{entry['part']}/merged_output.{fmt}"
+                    zf.write(path, arcname=arcname)
+                    entry["outputs"][fmt] = arcname
+                manifest.append(entry)
+                logging.info(f"Bulk part {entry['part']} finished: {entry['status']}")
+                yield sink.drain()
+            zf.writestr(MANIFEST_NAME, json.dumps({"parts": manifest}, indent=2, default=str))
+        yield sink.drain()
+    finally:
+        # Normally every part is done here; after a client disconnect some may still be running
+        _remove_when_finished(futures, work_dir)
@@ -1,19 +1,66 @@
-import sys
-sys.path.append("../")  # Add parent directory to sys.path for relative imports
-from api.utils.merge_data import final_data
+from api.utils.merge_data import final_data, build_merged_data
+from api.utils.export import expand_formats
 import os
 import uuid
-from typing import List
+import zipfile
+from typing import List, Optional
 
 
-def process_files(excel_path: str, txt_paths: List[str]) -> str:
-    """Process an Excel file and a list of TXT file paths. Returns output path."""
-    unique_id = uuid.uuid4().hex  # Generate a unique identifier
-    output_filename = f"merged_output_{unique_id}.xlsx"
+def _output_dir() -> str:
     # Get the absolute path of the uploads directory
     base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     output_dir = os.path.join(base_dir, "uploads")
     os.makedirs(output_dir, exist_ok=True)  # Ensure the directory exists
-    output_path = os.path.join(output_dir, output_filename)
-    final_data(excel_path, txt_paths, output_path)  # Pass the full output path
-    return output_path
+    return output_dir
+
+
+def _remove_outputs(outputs: dict) -> None:
+    for path in outputs.values():
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def process_files(
+    excel_path: str,
+    txt_paths: List[str],
+    output_format: str = "xlsx",
+    include_unmatched: bool = True,
+    measurement_maps: Optional[List[dict]] = None,
+) -> str:
+    """Process an Excel file and a list of TXT file paths. Returns output path.
+
+    output_format is 'xlsx', 'csv', 'parquet' or 'all'; 'all' returns a ZIP holding every format.
+    include_unmatched controls the 'unmatched' sheet of the styled workbook.
+    measurement_maps may hold the already parsed TXT files (same order as txt_paths).
+    """
+    output_format = output_format.lower()
+    unique_id = uuid.uuid4().hex  # Generate a unique identifier
+    output_filename = f"merged_output_{unique_id}.xlsx"
+    output_path = os.path.join(_output_dir(), output_filename)
+    outputs = final_data(
+        excel_path, txt_paths, output_path,
+        output_format=output_format, include_unmatched=include_unmatched,
+        measurement_maps=measurement_maps
+    )  # Pass the full output path
+    # final_data logs and swallows workbook errors; never hand back a partial result
+    missing = [fmt for fmt in expand_formats(output_format) if fmt not in outputs]
+    if missing:
+        _remove_outputs(outputs)
+        raise RuntimeError(f"Output not generated for: {', '.join(missing)}")
+    if output_format != "all":
+        return outputs[output_format]
+
+    zip_path = os.path.join(_output_dir(), f"merged_output_{unique_id}.zip")
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for fmt, path in outputs.items():
+            zf.write(path, arcname=f"merged_output.{fmt}")
+    _remove_outputs(outputs)
+    return zip_path
+
+
+def build_merged_table(excel_path: str, txt_paths: List[str], measurement_maps: Optional[List[dict]] = None):
+    """Build the merged DataFrame only, skipping all workbook styling (used for streamed CSV)."""
+    merged_df, _, _, _, _ = build_merged_data(
+        excel_path, txt_paths, build_header=False, include_unmatched=False, measurement_maps=measurement_maps
+    )
+    return merged_df
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import uuid
+import pickle
+import shutil
+import logging
+from typing import Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SESSION_DIR = os.path.join(BASE_DIR, "uploads", "sessions")
+
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+TXT_EXTENSIONS = (".txt",)
+SESSION_FILE = "session.json"
+# Sessions without activity for this long are removed (finished ones are removed right away)
+SESSION_TTL_HOURS = float(os.environ.get("CONVERSION_UPLOAD_TTL_HOURS", "24"))
+
+
+class UploadSessionError(ValueError):
+    """Invalid request against an upload session (unknown id, bad offset, bad file list...)."""
+
+
+class UnknownSession(UploadSessionError):
+    """No upload session with that id (never created, or already cleaned up)."""
+
+
+class OffsetMismatch(UploadSessionError):
+    """Chunk offset does not match the bytes already stored; carries the offset to resume from."""
+
+    def __init__(self, expected: int):
+        super().__init__(f"Chunk offset mismatch; resume from byte {expected}")
+        self.expected = expected
+
+
+# Session state lives on disk only (no per-process memory), so the chunks of one upload may be
+# handled by different uvicorn workers and an interrupted upload can resume on any of them.
+
+def _session_path(upload_id: str) -> str:
+    if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+        raise UnknownSession("Unknown upload session")
+    path = os.path.join(SESSION_DIR, upload_id)
+    if not os.path.isdir(path):
+        raise UnknownSession("Unknown upload session")
+    return path
+
+
+def _stored_name(index: int, name: str) -> str:
+    return f"{index:04d}_{os.path.basename(name)}"
+
+
+def _report_path(file_path: str) -> str:
+    return f"{file_path}.report.pkl"
+
+
+def create_session(files: List[Dict]) -> Dict:
+    """Start an upload: files is a list of {"name", "size"}; exactly one Excel template plus TXT files."""
+    if not isinstance(files, list) or not all(isinstance(f, dict) for f in files):
+        raise UploadSessionError("'files' must be a list of {\"name\", \"size\"} objects")
+    entries = []
+    for index, f in enumerate(files):
+        name = os.path.basename(str(f.get("name", "")))
+        try:
+            size = int(f.get("size", -1))
+        except (TypeError, ValueError):
+            raise UploadSessionError(f"Invalid size for '{name}'")
+        lower = name.lower()
+        if lower.endswith(EXCEL_EXTENSIONS):
+            kind = "excel"
+        elif lower.endswith(TXT_EXTENSIONS):
+            kind = "txt"
+        else:
+            raise UploadSessionError(f"Invalid file '{name}'. Only .xlsx/.xls and .txt files are allowed.")
+        if size < 0:
+            raise UploadSessionError(f"Missing size for '{name}'")
+        entries.append({"index": index, "name": name, "size": size, "kind": kind,
+                        "stored": _stored_name(index, name)})
+    if sum(e["kind"] == "excel" for e in entries) != 1:
+        raise UploadSessionError("Exactly one Excel file is required.")
+    if not any(e["kind"] == "txt" for e in entries):
+        raise UploadSessionError("At least one TXT file is required.")
+
+    sweep_sessions()
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(SESSION_DIR, upload_id)
+    os.makedirs(path)
+    for entry in entries:
+        if entry["size"] == 0:
+            # No chunk is ever sent for an empty file; it is complete as soon as it exists
+            open(os.path.join(path, entry["stored"]), "wb").close()
+    with open(os.path.join(path, SESSION_FILE), "w", encoding="utf-8") as f:
+        json.dump({"created": time.time(), "files": entries}, f)
+    logging.info(f"Created upload session {upload_id} with {len(entries)} files")
+    return session_status(upload_id)
+
+
+def _load_session(upload_id: str):
+    path = _session_path(upload_id)
+    with open(os.path.join(path, SESSION_FILE), encoding="utf-8") as f:
+        return path, json.load(f)
+
+
+def _received(path: str, entry: Dict) -> int:
+    file_path = os.path.join(path, entry["stored"])
+    return os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+
+def session_status(upload_id: str) -> Dict:
+    """Bytes received per file, so a client can resume each one where it stopped."""
+    path, session = _load_session(upload_id)
+    files = []
+    for entry in session["files"]:
+        received = _received(path, entry)
+        files.append({
+            "index": entry["index"], "name": entry["name"], "size": entry["size"], "kind": entry["kind"],
+            "received": received, "complete": received == entry["size"],
+            "parsed": os.path.exists(_report_path(os.path.join(path, entry["stored"]))),
+        })
+    return {"upload_id": upload_id, "files": files, "complete": all(f["complete"] for f in files)}
+
+
+def write_chunk(upload_id: str, index: int, offset: int, data: bytes) -> Dict:
+    """Store a chunk of file index at offset. Returns the file status; 'complete' once all bytes are in.
+
+    The chunk is written at offset, not appended: a retried request racing the original
+    (both past the offset check) writes the same bytes to the same place instead of twice.
+    """
+    path, session = _load_session(upload_id)
+    if not 0 <= index < len(session["files"]):
+        raise UploadSessionError(f"Unknown file index {index}")
+    entry = session["files"][index]
+    received = _received(path, entry)
+    if offset != received:
+        raise OffsetMismatch(received)
+    if offset + len(data) > entry["size"]:
+        raise UploadSessionError(f"Chunk exceeds declared size of '{entry['name']}'")
+    fd = os.open(os.path.join(path, entry["stored"]), os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        os.lseek(fd, offset, os.SEEK_SET)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    received = offset + len(data)
+    return {"index": index, "name": entry["name"], "kind": entry["kind"],
+            "received": received, "complete": received == entry["size"]}
+
+
+def parse_completed_file(upload_id: str, index: int) -> None:
+    """Parse a fully received TXT file now and keep the parsed report next to it.
+
+    Runs as a background task after the last chunk of a file arrives, so parsing overlaps
+    with the rest of the upload instead of waiting for finalise.
+    """
+    from api.utils.extract_measurements import extract_report
+
+    path, session = _load_session(upload_id)
+    entry = session["files"][index]
+    file_path = os.path.join(path, entry["stored"])
+    try:
+        report = extract_report(file_path)
+    except Exception as e:
+        # finalise parses it again and reports the error there
+        logging.error(f"Early parse of {entry['name']} failed: {str(e)}")
+        return
+    tmp_path = f"{_report_path(file_path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(report, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _report_path(file_path))
+
+
+def session_inputs(upload_id: str):
+    """Return (excel_path, txt_paths, measurement_maps, reports) for a fully uploaded session.
+
+    TXT files already parsed during the upload are loaded from their stored reports; any that
+    are not (e.g. the background parse has not finished yet) are parsed here.
+    """
+    from api.utils.merge_data import build_measurement_map, load_report
+
+    status = session_status(upload_id)
+    incomplete = [f["name"] for f in status["files"] if not f["complete"]]
+    if incomplete:
+        raise UploadSessionError(f"Upload incomplete: {', '.join(incomplete)}")
+
+    path, session = _load_session(upload_id)
+    excel_path: Optional[str] = None
+    txt_paths, maps, reports = [], [], []
+    for entry in session["files"]:
+        file_path = os.path.join(path, entry["stored"])
+        if entry["kind"] == "excel":
+            excel_path = file_path
+            continue
+        txt_paths.append(file_path)
+        if os.path.exists(_report_path(file_path)):
+            with open(_report_path(file_path), "rb") as f:
+                report = pickle.load(f)
+            mmap = build_measurement_map(report[1])
+        else:
+            try:
+                report, mmap = load_report(file_path)
+            except Exception as e:
+                raise UploadSessionError(f"Could not read '{entry['name']}': {str(e)}")
+        reports.append(report)
+        maps.append(mmap)
+    return excel_path, txt_paths, maps, reports
+
+
+def discard_session(upload_id: str) -> None:
+    """Remove a session and its files (after it has been finalised)."""
+    try:
+        path = _session_path(upload_id)
+    except UnknownSession:
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    logging.info(f"Removed upload session {upload_id}")
+
+
+def sweep_sessions(max_age_hours: float = SESSION_TTL_HOURS) -> int:
+    """Remove sessions abandoned for longer than max_age_hours; returns how many were removed.
+
+    A session's age is counted from its last activity: creation or the latest chunk written.
+    """
+    if not os.path.isdir(SESSION_DIR):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for entry in os.scandir(SESSION_DIR):
+        if not entry.is_dir():
+            continue
+        try:
+            with open(os.path.join(entry.path, SESSION_FILE), encoding="utf-8") as f:
+                last_activity = json.load(f)["created"]
+            last_activity = max([last_activity] + [e.stat().st_mtime for e in os.scandir(entry.path)])
+        except (OSError, ValueError, KeyError):
+            # Half-created or already being removed; fall back to the directory's own mtime
+            try:
+                last_activity = entry.stat().st_mtime
+            except OSError:
+                continue
+        if last_activity < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    if removed:
+        logging.info(f"Removed {removed} abandoned upload session(s)")
+    return removed
@@ -0,0 +1,264 @@
+import os
+import time
+import queue
+import datetime
+import logging
+import argparse
+import threading
+from api.utils.merge_data import final_data, load_report
+from api.utils.history_store import record_files
+from api.utils.part_resolver import PartResolver, REPORT_NAME
+
+try:
+    # inotify (Linux) / native backends; optional, falls back to directory polling
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TXT_EXTENSIONS = ('.txt',)
+
+
+class _PartState:
+    """Parsed TXT files of one report (a part's day, up to max_files files), plus what still has to be written."""
+
+    def __init__(self, day, seq=1):
+        self.day = day
+        self.seq = seq
+        self.maps = {}          # txt path -> measurement map, in arrival order
+        self.unrecorded = {}    # txt path -> parsed report not yet in the history store
+        self.dirty = 0          # files received since the last save
+        self.last_change = 0.0
+
+
+class HotFolderWatcher:
+    """Watch a folder for CMM TXT reports and keep each part's merged report up to date.
+
+    Files are considered complete once their size and mtime have not changed for
+    settle_seconds. Each completed file is parsed once, immediately; the parsed reports are queued
+    (bounded, so a burst blocks the detector instead of growing memory) and a single merger
+    thread rewrites a part's report once that part has been quiet for batch_seconds, or after
+    max_batch new files. A burst of hundreds of files therefore results in a few saves.
+    The same parsed reports are appended to the history store by the merger on each save.
+
+    Reports rotate per day (by TXT modification date) and after max_files files, so each save
+    only merges that report's files. A day's parsed maps are dropped once it has been written
+    and idle for retain_seconds.
+    """
+
+    def __init__(self, watch_dir, report_dir, settle_seconds=2.0, batch_seconds=5.0, max_batch=200,
+                 poll_interval=1.0, queue_size=500, report_name=REPORT_NAME, use_inotify=True,
+                 max_files=500, retain_seconds=3600.0):
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.resolver = PartResolver(watch_dir, report_dir, report_name)
+        self.settle_seconds = settle_seconds
+        self.batch_seconds = batch_seconds
+        self.max_batch = max_batch
+        self.max_files = max_files
+        self.retain_seconds = retain_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and Observer is not None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._candidates = {}   # path -> (size, mtime_ns, time the signature was first seen)
+        self._done = {}         # path -> (size, mtime_ns) last parsed
+        self._parts = {}        # (part, day) -> _PartState being filled
+        self._last_seq = {}     # (part, day) -> seq of its last dropped report, never overwritten
+
+    # -- detection -------------------------------------------------------------------------
+
+    def _is_txt(self, path):
+        return path.lower().endswith(TXT_EXTENSIONS) and not os.path.basename(path).startswith('.')
+
+    def mark(self, path):
+        """Note that path was created/changed; it is parsed once it has settled."""
+        if self._is_txt(path):
+            with self._lock:
+                self._candidates.setdefault(path, None)
+
+    def _scan(self):
+        """Polling fallback: mark every TXT file under the watch folder (one level of part folders)."""
+        for entry in os.scandir(self.watch_dir):
+            if entry.is_dir():
+                for sub in os.scandir(entry.path):
+                    if sub.is_file():
+                        self.mark(sub.path)
+            elif entry.is_file():
+                self.mark(entry.path)
+
+    def _settled_files(self):
+        """Return candidates whose size/mtime stayed unchanged for settle_seconds."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, seen in list(self._candidates.items()):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    del self._candidates[path]
+                    continue
+                signature = (st.st_size, st.st_mtime_ns)
+                if self._done.get(path) == signature:
+                    del self._candidates[path]
+                elif seen is None or seen[:2] != signature:
+                    self._candidates[path] = signature + (now,)
+                elif now - seen[2] >= self.settle_seconds:
+                    del self._candidates[path]
+                    ready.append((path, signature))
+        return ready
+
+    def _detect_loop(self):
+        while not self._stop.is_set():
+            if not self.use_inotify:
+                self._scan()
+            for path, signature in self._settled_files():
+                part = self.resolver.part_for(path)
+                if part is None:
+                    logging.warning(f"No REPORT folder matches {path}; ignoring")
+                    self._done[path] = signature
+                    continue
+                # Marked done even if parsing fails: a malformed file is retried only once it changes
+                self._done[path] = signature
+                try:
+                    report, mmap = load_report(path)
+                except Exception as e:
+                    logging.error(f"Failed to parse {path}: {str(e)}")
+                    continue
+                day = datetime.date.fromtimestamp(signature[1] / 1e9).isoformat()
+                # Blocks while the merger is behind (back-pressure)
+                self._queue.put((part, day, path, report, mmap))
+            self._stop.wait(self.poll_interval)
+
+    # -- merging ---------------------------------------------------------------------------
+
+    def _merge_loop(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                part, day, path, report, mmap = self._queue.get(timeout=self.poll_interval)
+                state = self._state_for(part, day, path)
+                state.maps[path] = mmap
+                state.unrecorded[path] = report
+                state.dirty += 1
+                state.last_change = time.monotonic()
+            except queue.Empty:
+                pass
+            self._flush(force=self._stop.is_set())
+
+    def _state_for(self, part, day, path):
+        """The report state a new file goes to; a full report is written and the next one started."""
+        state = self._parts.get((part, day))
+        if state is None:
+            state = self._parts[(part, day)] = _PartState(day, self._last_seq.get((part, day), 0) + 1)
+        elif len(state.maps) >= self.max_files and path not in state.maps:
+            if state.dirty:
+                self.write_report(part, state)
+            state = self._parts[(part, day)] = _PartState(day, state.seq + 1)
+        return state
+
+    def _flush(self, force=False):
+        now = time.monotonic()
+        today = datetime.date.today().isoformat()
+        for key, state in list(self._parts.items()):
+            part = key[0]
+            if state.dirty and (force or state.dirty >= self.max_batch or now - state.last_change >= self.batch_seconds):
+                self.write_report(part, state)
+            if not state.dirty and state.day != today and now - state.last_change >= self.retain_seconds:
+                # Past day, written and quiet: free its maps (a late file starts the next report)
+                self._last_seq[key] = state.seq
+                del self._parts[key]
+
+    def write_report(self, part, state):
+        """Rewrite the state's REPORT/<part>/ report from the already parsed maps in one save,
+        and record the files that arrived since the last save in the history store."""
+        if state.unrecorded:
+            paths = list(state.unrecorded)
+            record_files(paths, part, reports=[state.unrecorded[p] for p in paths])
+            state.unrecorded = {}
+        template = self.resolver.template_for(part)
+        if template is None:
+            logging.warning(f"No template in REPORT/{part}; {state.dirty} file(s) kept until one appears")
+            state.dirty = 0
+            return
+        output = self.resolver.report_for(part, state.day, state.seq)
+        paths = list(state.maps)
+        logging.info(f"Updating {output}: {state.dirty} new file(s), {len(paths)} total")
+        try:
+            final_data(template, paths, output, measurement_maps=[state.maps[p] for p in paths])
+        except Exception as e:
+            logging.error(f"Failed to update report for {part}: {str(e)}")
+        state.dirty = 0
+
+    # -- lifecycle -------------------------------------------------------------------------
+
+    def run(self):
+        """Run until stop() is called (or KeyboardInterrupt)."""
+        observer = None
+        if self.use_inotify:
+            observer = Observer()
+            observer.schedule(_MarkHandler(self), self.watch_dir, recursive=True)
+            observer.start()
+            self._scan()  # pick up files that were already there
+        logging.info(f"Watching {self.watch_dir} ({'inotify' if observer else 'polling'})")
+
+        detector = threading.Thread(target=self._detect_loop, name="hotfolder-detect", daemon=True)
+        detector.start()
+        try:
+            self._merge_loop()
+        except KeyboardInterrupt:
+            self._stop.set()
+            self._merge_loop()
+        finally:
+            self._stop.set()
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        self._stop.set()
+
+
+class _MarkHandler(FileSystemEventHandler):
+    """watchdog handler forwarding create/modify/move events to HotFolderWatcher.mark."""
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.mark(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.mark(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.mark(event.dest_path)
+
+
+if __name__ == "__main__":
+    # python -m api.services.watch_service --watch TXT --reports REPORT
+    parser = argparse.ArgumentParser(description="Auto-merge CMM TXT files dropped into a hot folder.")
+    parser.add_argument("--watch", default="TXT", help="Folder the CMM stations write TXT reports into")
+    parser.add_argument("--reports", default="REPORT", help="Folder holding REPORT/<part>/ templates")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds a file must stay unchanged")
+    parser.add_argument("--batch", type=float, default=5.0, help="Quiet seconds before a part's report is saved")
+    parser.add_argument("--max-batch", type=int, default=200, help="Save after this many new files regardless")
+    parser.add_argument("--max-files", type=int, default=500, help="Start a new report after this many files in one day")
+    parser.add_argument("--retain", type=float, default=3600.0, help="Seconds a past day's files are kept for late arrivals")
+    parser.add_argument("--poll", type=float, default=1.0, help="Poll interval in seconds")
+    parser.add_argument("--polling", action="store_true", help="Force polling even if watchdog is installed")
+    args = parser.parse_args()
+
+    HotFolderWatcher(
+        args.watch, args.reports,
+        settle_seconds=args.settle, batch_seconds=args.batch, max_batch=args.max_batch,
+        poll_interval=args.poll, use_inotify=not args.polling,
+        max_files=args.max_files, retain_seconds=args.retain,
+    ).run()
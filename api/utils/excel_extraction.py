@@ -97,7 +97,13 @@ def remove_rows_after_index(input_file, output_file, index_row):
 
 
 
-def extract_excel_data(file_path):
+def extract_excel_data(file_path, build_header=True, header_file_path="temp_modified.xlsx"):
+    """Extract template rows keyed by Print No.
+
+    When build_header is True the rows up to the header are also saved to
+    header_file_path, used later to produce the styled output; pass False
+    when only the data is needed (header_file_path is then None).
+    """
     logging.info(f"Starting extraction of data from Excel file: {file_path}")
 
     # Read the entire sheet without headers using a compatible engine
@@ -113,17 +119,18 @@ def extract_excel_data(file_path):
         raise KeyError("Could not find a row containing 'Print No'.")
 
     # Extract parent and sub-columns
-    header_file_path = "temp_modified.xlsx"
-    
-    try:
-        remove_rows_after_index(
-            input_file=file_path,
-            output_file=header_file_path,
-            index_row=header_row_idx
-        )
-    except Exception as e:
-        logging.error(f"Error processing Excel file: {str(e)}")
-        raise  # Re-raise the exception to see the full error details
+    if not build_header:
+        header_file_path = None
+    else:
+        try:
+            remove_rows_after_index(
+                input_file=file_path,
+                output_file=header_file_path,
+                index_row=header_row_idx
+            )
+        except Exception as e:
+            logging.error(f"Error processing Excel file: {str(e)}")
+            raise  # Re-raise the exception to see the full error details
    
     parent_columns = df.iloc[header_row_idx]
     sub_columns = df.iloc[header_row_idx + 1]
@@ -0,0 +1,72 @@
+import io
+import os
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Output formats accepted by final_data / process_files / the upload endpoint
+OUTPUT_FORMATS = ('xlsx', 'csv', 'parquet', 'all')
+
+MEDIA_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'zip': 'application/zip',
+}
+
+
+def expand_formats(output_format):
+    """Validate output_format and return the list of concrete formats to write."""
+    fmt = (output_format or 'xlsx').lower()
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{output_format}'. Use one of: {', '.join(OUTPUT_FORMATS)}")
+    if fmt == 'all':
+        return ['xlsx', 'csv', 'parquet']
+    return [fmt]
+
+
+def with_extension(path, fmt):
+    """Return path with its extension replaced by the one for fmt."""
+    return os.path.splitext(path)[0] + '.' + fmt
+
+
+def write_csv(df, output_path):
+    """Write the merged table as plain CSV (no styling)."""
+    logging.info(f"Writing CSV output to {output_path}")
+    df.to_csv(output_path, index=False)
+    return output_path
+
+
+def _parquet_safe(df):
+    """Make mixed-type object columns Parquet friendly by storing their values as text."""
+    import pandas as pd  # imported lazily so this module stays cheap to import from the routes
+
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v))
+    return df
+
+
+def write_parquet(df, output_path):
+    """Write the merged table as Parquet. Requires pyarrow (or fastparquet)."""
+    logging.info(f"Writing Parquet output to {output_path}")
+    try:
+        _parquet_safe(df).to_parquet(output_path, index=False)
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet output. Install it with: pip install pyarrow") from e
+    return output_path
+
+
+def iter_csv(df, chunk_rows=500):
+    """Yield the table as CSV text in chunks of chunk_rows rows, header first.
+
+    Used for streamed responses so the first bytes leave the server without
+    writing (or fully rendering) a file.
+    """
+    for start in range(0, max(len(df), 1), chunk_rows):
+        buf = io.StringIO()
+        df.iloc[start:start + chunk_rows].to_csv(buf, index=False, header=(start == 0))
+        yield buf.getvalue()
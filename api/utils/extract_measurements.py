@@ -2,17 +2,12 @@ import re
 import os
 import chardet
 import logging
+from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def extract_measurements(file_path):
-    logging.info(f"Starting extraction of measurements from file: {file_path}")
-
-    measurements = []
-    current_dim = None
-    units = None
-
+def _read_lines(file_path):
     # Detect file encoding
     with open(file_path, 'rb') as f:
         raw_data = f.read()
@@ -21,7 +16,56 @@ def extract_measurements(file_path):
 
     # Read the file with the detected encoding
     with open(file_path, 'r', encoding=encoding) as f:
-        lines = f.readlines()
+        return f.readlines()
+
+def parse_report_info(lines):
+    """Parse the report preamble (DATE/TIME, PART NAME, serial number) from the first lines.
+
+    Returns a dict with 'part_name', 'serial' and 'measured_at' (datetime or None).
+    'Serial Number:' (the operator-entered serial) wins over 'SER NUMBER'.
+    """
+    info = {'part_name': None, 'serial': None, 'measured_at': None}
+    ser_number = None
+    for raw in lines:
+        line = raw.strip()
+        if line.startswith('DIM') or line.startswith('PART NUMBER='):
+            break
+        date_match = re.search(r'DATE=(\S+)\s+TIME=(\d{1,2}:\d{2}:\d{2}\s*[AP]M)', line, re.IGNORECASE)
+        if date_match and info['measured_at'] is None:
+            try:
+                info['measured_at'] = datetime.strptime(f"{date_match.group(1)} {date_match.group(2).upper()}", '%d-%b-%y %I:%M:%S %p')
+            except ValueError:
+                logging.debug(f"Unrecognised report date: {line}")
+            continue
+        key, sep, value = line.partition(':')
+        if not sep:
+            continue
+        key = key.strip().upper()
+        value = value.strip().lstrip(':').strip()
+        if key == 'PART NAME':
+            # 'CALIPER FIN    PART NUMBER:326...' / 'CALIPER,FIN(Groove opr)   PARTNO: 326...'
+            info['part_name'] = re.split(r'\s{2,}PART\s*N', value, maxsplit=1, flags=re.IGNORECASE)[0].strip() or None
+        elif key == 'SER NUMBER':
+            ser_number = value or None
+        elif key == 'SERIAL NUMBER':
+            info['serial'] = value or None
+    if info['serial'] is None:
+        info['serial'] = ser_number
+    return info
+
+def extract_report(file_path):
+    """Read a TXT report once and return (report_info, measurements)."""
+    lines = _read_lines(file_path)
+    return parse_report_info(lines), _parse_measurement_lines(lines)
+
+def extract_measurements(file_path):
+    logging.info(f"Starting extraction of measurements from file: {file_path}")
+    return _parse_measurement_lines(_read_lines(file_path))
+
+def _parse_measurement_lines(lines):
+    measurements = []
+    current_dim = None
+    units = None
 
     i = 0
     while i < len(lines):
@@ -0,0 +1,277 @@
+import os
+import re
+import sys
+import sqlite3
+import hashlib
+import logging
+import argparse
+import functools
+from datetime import date, datetime, timedelta
+from api.utils.extract_measurements import extract_report
+from api.utils.part_resolver import PartResolver
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, "uploads", "history.sqlite3")
+# REPORT/<part>/ folders; history parts are named after them whichever way a TXT comes in
+REPORT_DIR = os.environ.get("CONVERSION_REPORT_DIR", os.path.join(BASE_DIR, "REPORT"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    part TEXT NOT NULL,
+    part_name TEXT,
+    serial TEXT,
+    measured_at TEXT,
+    source TEXT,
+    content_hash TEXT NOT NULL UNIQUE,
+    ingested_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    part TEXT NOT NULL,
+    dim INTEGER,
+    dimension TEXT,
+    axis TEXT,
+    nominal REAL,
+    plus_tol REAL,
+    minus_tol REAL,
+    measured REAL,
+    deviation REAL,
+    outtol REAL,
+    measured_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_measurements_part_dim_time ON measurements (part, dim, measured_at);
+CREATE INDEX IF NOT EXISTS idx_measurements_run ON measurements (run_id);
+CREATE INDEX IF NOT EXISTS idx_runs_part_time ON runs (part, measured_at);
+"""
+
+
+def db_path():
+    """Path of the history database; CONVERSION_HISTORY_DB=off disables recording."""
+    return os.environ.get("CONVERSION_HISTORY_DB", DEFAULT_DB_PATH)
+
+
+def history_enabled():
+    return db_path().strip().lower() not in ("", "0", "off", "false", "no")
+
+
+def connect(path=None):
+    """Open (and create if needed) the history database."""
+    path = path or db_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # WAL + busy timeout: API workers, bulk pool processes and the watcher may all write
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _dimension_number(dimension):
+    d = re.search(r'#(\d+)', (dimension or '').split('=')[0])
+    return int(d.group(1)) if d else None
+
+
+def ingest_file(conn, txt_path, part, reassign=False, report=None):
+    """Append one TXT report to the store. Returns the number of measurements added
+    (0 if already stored or the report holds no measurements).
+
+    report is the (report_info, measurements) pair of extract_report(), if the caller already parsed it.
+    reassign moves an already stored copy of the file to part (e.g. one recorded under another name).
+    """
+    with open(txt_path, 'rb') as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    existing = conn.execute("SELECT id, part FROM runs WHERE content_hash = ?", (content_hash,)).fetchone()
+    if existing:
+        if reassign and part and existing['part'] != part:
+            with conn:
+                conn.execute("UPDATE runs SET part = ? WHERE id = ?", (part, existing['id']))
+                conn.execute("UPDATE measurements SET part = ? WHERE run_id = ?", (part, existing['id']))
+            logging.info(f"History: moved {os.path.basename(txt_path)} from part {existing['part']} to {part}")
+        return 0
+
+    info, measurements = report if report is not None else extract_report(txt_path)
+    if not measurements:
+        logging.warning(f"History: no measurements in {os.path.basename(txt_path)}; not recorded")
+        return 0
+    measured_at = info['measured_at'] or datetime.fromtimestamp(os.path.getmtime(txt_path))
+    measured_at = measured_at.isoformat(timespec='seconds')
+    run_part = part or info['part_name'] or ''
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO runs (part, part_name, serial, measured_at, source, content_hash, ingested_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_part, info['part_name'], info['serial'], measured_at,
+             os.path.basename(txt_path), content_hash, datetime.now().isoformat(timespec='seconds')),
+        )
+        if not cur.rowcount:
+            return 0  # stored concurrently by another process
+        run_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO measurements (run_id, part, dim, dimension, axis, nominal, plus_tol, minus_tol, "
+            "measured, deviation, outtol, measured_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (run_id, run_part, _dimension_number(m.get('dimension')), m.get('dimension'), m.get('axis'),
+                 _to_float(m.get('nominal')), _to_float(m.get('+tol')), _to_float(m.get('-tol')),
+                 _to_float(m.get('measured')), _to_float(m.get('deviation')), _to_float(m.get('outtol')),
+                 measured_at)
+                for m in measurements
+            ],
+        )
+    return len(measurements)
+
+
+@functools.lru_cache(maxsize=4)
+def _resolver(report_dir):
+    return PartResolver(report_dir, report_dir)
+
+
+def resolve_part(part=None, template_name=None, txt_names=(), report_dir=None):
+    """Name the REPORT/<part>/ folder a merge belongs to, matched like the hot-folder watcher does.
+
+    An explicit part is matched against the folders (e.g. 'ATI S19' -> 'ATIS19') and kept as given
+    if none matches. Otherwise the template name is tried (it usually sits in that folder), then
+    the TXT names. Falls back to the template's name, or None (the report's PART NAME) without one.
+    """
+    report_dir = report_dir or REPORT_DIR
+    resolver = _resolver(os.path.abspath(report_dir)) if os.path.isdir(report_dir) else None
+    if part:
+        return (resolver and resolver.part_for_name(part)) or part
+    if resolver is not None:
+        for name in ([template_name] if template_name else []) + [os.path.basename(n) for n in txt_names]:
+            found = resolver.part_for_name(name)
+            if found:
+                return found
+    if template_name:
+        logging.warning(f"History: no REPORT folder matches {template_name}; recording under its name")
+        return os.path.splitext(os.path.basename(template_name))[0]
+    return None
+
+
+def record_files(txt_paths, part=None, template_name=None, txt_names=None, reports=None):
+    """Best-effort recording of merged TXT files; never raises into the merge path.
+
+    The part is resolved with resolve_part() (txt_names: the original names, if txt_paths were
+    renamed on upload), so uploads, sessions, bulk jobs, the watcher and the backfill all record
+    the same REPORT folder name for the same files.
+    reports, if given, holds the already parsed extract_report() result of each file (same order).
+    """
+    if not history_enabled():
+        return
+    try:
+        part = resolve_part(part, template_name, txt_names or txt_paths)
+        conn = connect()
+    except Exception as e:
+        logging.error(f"History store unavailable: {str(e)}")
+        return
+    try:
+        for path, report in zip(txt_paths, reports or [None] * len(txt_paths)):
+            try:
+                added = ingest_file(conn, path, part, report=report)
+                logging.info(f"History: {added} measurements recorded from {os.path.basename(path)} (part {part})")
+            except Exception as e:
+                logging.error(f"History: failed to record {path}: {str(e)}")
+    finally:
+        conn.close()
+
+
+def _until_bound(until):
+    """SQL comparison for an `until` filter; a plain date ('2024-05-31') includes that whole day."""
+    try:
+        day = date.fromisoformat(until)
+    except ValueError:
+        return "<=", until
+    return "<", (day + timedelta(days=1)).isoformat()
+
+
+def query_history(conn, part, dim=None, axis=None, since=None, until=None, limit=500):
+    """Most recent measurements of a part (optionally one dimension/axis), newest first."""
+    sql = ("SELECT m.measured_at, r.serial, m.dim, m.dimension, m.axis, m.nominal, m.plus_tol, m.minus_tol, "
+           "m.measured, m.deviation, m.outtol, r.source FROM measurements m JOIN runs r ON r.id = m.run_id "
+           "WHERE m.part = ?")
+    params = [part]
+    if dim is not None:
+        sql += " AND m.dim = ?"
+        params.append(dim)
+    if axis:
+        sql += " AND m.axis = ?"
+        params.append(axis)
+    if since:
+        sql += " AND m.measured_at >= ?"
+        params.append(since)
+    if until:
+        op, bound = _until_bound(until)
+        sql += f" AND m.measured_at {op} ?"
+        params.append(bound)
+    sql += " ORDER BY m.measured_at DESC LIMIT ?"
+    params.append(limit)
+    return [dict(row) for row in conn.execute(sql, params)]
+
+
+def list_dimensions(conn, part):
+    """Dimensions recorded for a part with their sample count and latest measurement time."""
+    rows = conn.execute(
+        "SELECT dim, axis, COUNT(*) AS count, MAX(measured_at) AS last_measured_at FROM measurements "
+        "WHERE part = ? GROUP BY dim, axis ORDER BY dim, axis", (part,)
+    )
+    return [dict(row) for row in rows]
+
+
+def list_parts(conn):
+    """Parts in the store with their run count and latest run time."""
+    rows = conn.execute(
+        "SELECT part, COUNT(*) AS runs, MAX(measured_at) AS last_measured_at FROM runs GROUP BY part ORDER BY part"
+    )
+    return [dict(row) for row in rows]
+
+
+def backfill(txt_dir, report_dir=None, part=None, reassign=False):
+    """Ingest every TXT file under txt_dir. The part of each file is `part` if given, otherwise the
+    REPORT/<part>/ folder it resolves to (same matching as the hot-folder watcher), otherwise its name.
+    reassign also moves files that are already stored to that part."""
+    resolver = None
+    if part is None and report_dir and os.path.isdir(report_dir):
+        resolver = PartResolver(txt_dir, report_dir)
+
+    conn = connect()
+    files = added = 0
+    try:
+        for dirpath, _, filenames in os.walk(txt_dir):
+            for name in sorted(filenames):
+                if not name.lower().endswith('.txt'):
+                    continue
+                path = os.path.join(dirpath, name)
+                file_part = part or (resolver.part_for(path) if resolver else None) or os.path.splitext(name)[0]
+                try:
+                    added += ingest_file(conn, path, file_part, reassign=reassign)
+                    files += 1
+                except Exception as e:
+                    logging.error(f"Backfill: failed to ingest {path}: {str(e)}")
+    finally:
+        conn.close()
+    logging.info(f"Backfill finished: {files} files, {added} new measurements")
+    return files, added
+
+
+if __name__ == "__main__":
+    # Backfill the archive: python -m api.utils.history_store TXT --reports REPORT
+    parser = argparse.ArgumentParser(description="Load existing CMM TXT reports into the history store.")
+    parser.add_argument("txt_dir", nargs="?", default="TXT", help="Folder of TXT reports to ingest")
+    parser.add_argument("--reports", default="REPORT", help="REPORT folder used to resolve each file's part")
+    parser.add_argument("--part", default=None, help="Record every file under this part instead")
+    parser.add_argument("--reassign", action="store_true", help="Also move files already stored to the resolved part")
+    args = parser.parse_args()
+    if not history_enabled():
+        sys.exit("History store is disabled (CONVERSION_HISTORY_DB)")
+    backfill(args.txt_dir, args.reports, args.part, reassign=args.reassign)
@@ -1,13 +1,15 @@
 import pandas as pd
 import numpy as np
-import sys
+import os
 import re
 import logging
 import openpyxl
 from openpyxl.utils import get_column_letter
-sys.path.append("../")  # Add parent directory to sys.path for relative imports
-from api.utils.excel_extraction import extract_excel_data, copy_cell_format
-from api.utils.extract_measurements import extract_measurements
+from api.utils.excel_extraction import copy_cell_format
+from api.utils.template_store import load_template
+from api.utils.extract_measurements import extract_measurements, extract_report
+from api.utils.tolerance import add_tolerance_columns
+from api.utils.export import expand_formats, with_extension, write_csv, write_parquet
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -95,10 +97,21 @@ COLUMN_TO_RMV = ['OUT OF TOLERANCE', 'DEVIATION', 'OUT_OF_TOLERANCE','IDENTIFICA
 #     except Exception as e:
 #         logging.error(f"Error during Excel merge: {str(e)}")
 #         raise
-def merge_excel_with_header(output_file_path, header_file_path, final_output_path, header_row_idx):
+def _append_dataframe_sheet(workbook, sheet_name, df):
+    """Append df as a new plain sheet (header row + values) to an openpyxl workbook."""
+    logging.info(f"Writing {sheet_name} sheet with {len(df)} rows")
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append([str(c) for c in df.columns])
+    for row in df.itertuples(index=False):
+        sheet.append([None if pd.isna(v) else v for v in row])
+    return sheet
+
+def merge_excel_with_header(output_file_path, header_file_path, final_output_path, header_row_idx, extra_sheets=None):
     """
     Append data workbook into header workbook starting after header_row_idx,
     preserving header formatting from header_file_path.
+    extra_sheets maps sheet name -> DataFrame; each non-empty one is added as a plain sheet
+    in the same save (e.g. 'unmatched', 'summary').
     """
     logging.info("Starting Excel merge (append data into header) with format preservation")
     logging.info(f"Data file: {output_file_path}, Header file: {header_file_path}, header_row_idx: {header_row_idx}")
@@ -166,6 +179,10 @@ def merge_excel_with_header(output_file_path, header_file_path, final_output_pat
                         logging.debug(f"Failed to copy style for row {target_row} col {c}", exc_info=True)
                         continue
 
+        for sheet_name, sheet_df in (extra_sheets or {}).items():
+            if sheet_df is not None and not sheet_df.empty:
+                _append_dataframe_sheet(header_wb, sheet_name, sheet_df)
+
         # Save result back to final_output_path (overwrite or new file)
         header_wb.save(final_output_path)
         logging.info(f"Successfully saved merged file to {final_output_path}")
@@ -214,16 +231,87 @@ def _try_float(v):
     except Exception:
         return np.nan
 
-def final_data(excel_file_path, txt_file_paths, output_file_path):
-    """Merge Excel templates with one or more TXT measurement files.
+# Unmatched sheet column -> key of the TXT measurement dict (numeric columns are converted)
+UNMATCHED_COLUMNS = {
+    'DIMENSION': 'dimension',
+    'TOLERANCE_MAX': '+tol',
+    'TOLERANCE_MIN': '-tol',
+    'DEVIATION': 'deviation',
+    'OUT_OF_TOLERANCE': 'outtol',
+    'MEASURED': 'measured',
+}
+
+def _unmatched_measurements(per_file_maps, txt_file_paths, template_keys):
+    """Return a DataFrame of TXT measurements whose dimension number is not a template Print No."""
+    template_keys = set(template_keys)
+    records = []
+    for path, mmap in zip(txt_file_paths, per_file_maps):
+        # Set difference on the dimension index; rows are only built for the (few) unmatched keys
+        missing = mmap.keys() - template_keys
+        if missing:
+            file_name = os.path.basename(str(path))
+            records.extend((dn, file_name, mmap[dn]) for dn in missing)
+    if not records:
+        return pd.DataFrame()
+    records.sort(key=lambda r: (r[0], r[1]))
+
+    columns = {'FILE': [r[1] for r in records], 'DIMENSION_NUMBER': [r[0] for r in records]}
+    for col, key in UNMATCHED_COLUMNS.items():
+        values = [r[2].get(key) for r in records]
+        columns[col] = values if col == 'DIMENSION' else [_try_float(v) for v in values]
+    unmatched_df = pd.DataFrame(columns)
+    logging.info(f"Unmatched dimension numbers: {sorted(set(columns['DIMENSION_NUMBER']))}")
+    return unmatched_df
+
+def build_measurement_map(measurements):
+    """Map dimension number (from 'DIM #<n>...') to the first measurement of that dimension."""
+    mmap = {}
+    for mes in measurements:
+        if '#' in mes.get('dimension', ''):
+            try:
+                dp = mes.get('dimension', '').split('=')[0]
+                d = re.search(r'#(\d+)', dp)
+                if d:
+                    dn = int(d.group(1))
+                    # keep first measurement for this dimension in this file
+                    if dn not in mmap:
+                        mmap[dn] = mes
+            except Exception:
+                continue
+    return mmap
+
+def load_measurement_map(txt_path):
+    """Parse a TXT file and return its dimension -> measurement map."""
+    return build_measurement_map(extract_measurements(txt_path))
+
+def load_report(txt_path):
+    """Parse a TXT file once for both the merge and the history store.
+
+    Returns (report, measurement_map): report is extract_report()'s (report_info, measurements).
+    """
+    report = extract_report(txt_path)
+    return report, build_measurement_map(report[1])
+
+def build_merged_data(excel_file_path, txt_file_paths, evaluate=True, build_header=True, include_unmatched=True,
+                      measurement_maps=None):
+    """Merge Excel templates with one or more TXT measurement files in memory.
 
     txt_file_paths may be a single path (str) or a list of paths. When multiple TXT files
     are provided, measured values are written into columns named MEASURED-1, MEASURED-2, ...
+    When evaluate is True, tolerance statistics (min/max/mean, std dev, Cp/Cpk, NG count)
+    are appended per Print No and returned as a summary table.
+    build_header=False skips preparing the styled header workbook (not needed for CSV/Parquet).
+    include_unmatched=False skips collecting TXT measurements whose dimension is not in the
+    template (unmatched_df is then None).
+    measurement_maps, if given, holds the already parsed map of each TXT file (same order).
+
+    Returns:
+        (merged_df, summary_df, unmatched_df, header_file_path, header_row_idx)
     """
     logging.info("Starting data merging process.")
 
-    # Extract data from Excel file
-    excel_data, header_file_path,header_row_idx = extract_excel_data(excel_file_path)
+    # Extract data from Excel file (parsed once per distinct template, shared across workers)
+    excel_data, header_file_path,header_row_idx = load_template(excel_file_path, build_header=build_header)
     logging.debug(f"excel_Data keys: {list(excel_data)}")
 
     # Normalize keys inside excel_data templates to uppercase so they match pre_header columns
@@ -240,34 +328,34 @@ def final_data(excel_file_path, txt_file_paths, output_file_path):
         txt_file_paths = [txt_file_paths]
 
     # For each TXT file, extract measurements and build a mapping dim->first_measurement
-    per_file_maps = []  # list of dicts: [{dim: measurement, ...}, ...]
-    for txt_path in txt_file_paths:
-        file_meas = extract_measurements(txt_path)
-        mmap = {}
-        for mes in file_meas:
-            if '#' in mes.get('dimension', ''):
-                try:
-                    dp = mes.get('dimension', '').split('=')[0]
-                    d = re.search(r'#(\d+)', dp)
-                    if d:
-                        dn = int(d.group(1))
-                        # keep first measurement for this dimension in this file
-                        if dn not in mmap:
-                            mmap[dn] = mes
-                except Exception:
-                    continue
-        per_file_maps.append(mmap)
+    # (callers that already parsed the files, e.g. the hot-folder watcher, pass the maps in)
+    if measurement_maps is None:
+        per_file_maps = [load_measurement_map(txt_path) for txt_path in txt_file_paths]
+    else:
+        per_file_maps = list(measurement_maps)
 
     logging.debug(f"Per-file measurement maps count: {len(per_file_maps)}")
 
     # Build merged_data by iterating excel_data templates; create MEASURED-N columns for each file
     merged_data = []
-    unmatched_data = []
+    # Nominal and absolute spec limits per merged row, taken from the TXT (first file that has
+    # the dimension) and falling back to the template's TOLERANCE MIN/MAX
+    nominals, lowers, uppers = [], [], []
 
     multi_files = len(per_file_maps) > 1
 
     for key, template in excel_data.items():
         base = template.copy()
+        ref = next((m[key] for m in per_file_maps if key in m), None)
+        nominal = _try_float(ref.get('nominal')) if ref is not None else np.nan
+        if np.isnan(nominal):
+            nominals.append(np.nan)
+            lowers.append(template.get('TOLERANCE MIN'))
+            uppers.append(template.get('TOLERANCE MAX'))
+        else:
+            nominals.append(nominal)
+            lowers.append(nominal - _try_float(ref.get('-tol')))
+            uppers.append(nominal + _try_float(ref.get('+tol')))
         # For multiple files, add MEASURED-1..N; for single file, use 'MEASURED'
         if multi_files:
             for idx, mmap in enumerate(per_file_maps, start=1):
@@ -297,29 +385,12 @@ def final_data(excel_file_path, txt_file_paths, output_file_path):
                 base.setdefault('MEASURED', '')
             merged_data.append(base)
 
-    # Any measurement keys not present in excel_data are unmatched
-    logging.debug(f"MEger_data count before unmatched: {merged_data}")
-    all_keys_in_files = set().union(*[set(m.keys()) for m in per_file_maps]) if per_file_maps else set()
-    logging.info(f"All keys in measurement files: {all_keys_in_files}")
-    unmatched_keys = all_keys_in_files - set(excel_data.keys())
-    logging.info(f"Unmatched keys count: {unmatched_keys}")
-    for uk in unmatched_keys:
-        for mmap in per_file_maps:
-            mes = mmap.get(uk)
-            if mes:
-                unmatched_record = {
-                    'DIMENSION_NUMBER': uk,
-                    'DIMENSION': mes.get('dimension'),
-                    'TOLERANCE_MAX': mes.get('+tol'),
-                    'TOLERANCE_MIN': mes.get('-tol'),
-                    'DEVIATION': mes.get('deviation'),
-                    'OUT_OF_TOLERANCE': mes.get('outtol'),
-                    'MEASURED': mes.get('measured')
-                }
-                unmatched_data.append(unmatched_record)
-
-    logging.debug(f"unmatxhed_data count: {unmatched_data}")
-    logging.info(f"Built merged_data rows: {len(merged_data)}; unmatched: {len(unmatched_data)}")
+    # Any measurement keys not present in excel_data are unmatched (set difference per file)
+    unmatched_df = None
+    if include_unmatched:
+        unmatched_df = _unmatched_measurements(per_file_maps, txt_file_paths, excel_data.keys())
+
+    logging.info(f"Built merged_data rows: {len(merged_data)}; unmatched: {0 if unmatched_df is None else len(unmatched_df)}")
 
     # Convert merged_data to DataFrame and drop columns that are all NaN
     merged_df = pd.DataFrame(merged_data)
@@ -331,26 +402,71 @@ def final_data(excel_file_path, txt_file_paths, output_file_path):
        merged_df.drop(columns=cols_to_rmv, inplace=True)
     merged_df = move_measured_columns_to_end(merged_df)
     logging.debug(f"Merged DataFrame columns after dropping all-NaN and reordering: {merged_df.columns.tolist()}")
+
+    summary_df = None
+    if evaluate:
+        merged_df, summary_df = add_tolerance_columns(
+            merged_df,
+            nominals,
+            lowers,
+            uppers,
+            keys=excel_data.keys(),
+        )
+    return merged_df, summary_df, unmatched_df, header_file_path, header_row_idx
+
+
+def final_data(excel_file_path, txt_file_paths, output_file_path, evaluate=True, output_format="xlsx",
+               include_unmatched=True, measurement_maps=None):
+    """Merge Excel templates with TXT measurement files and write the result.
+
+    output_format is one of 'xlsx' (styled workbook at output_file_path), 'csv', 'parquet'
+    or 'all'. CSV/Parquet are written next to output_file_path with their own extension
+    straight from the merged DataFrame, without any openpyxl styling.
+    The styled workbook also gets an 'unmatched' sheet (TXT dimensions missing from the
+    template) unless include_unmatched is False.
+
+    Returns:
+        dict mapping each written format to its output path.
+    """
+    formats = expand_formats(output_format)
+    styled = 'xlsx' in formats
+    merged_df, summary_df, unmatched_df, header_file_path, header_row_idx = build_merged_data(
+        excel_file_path, txt_file_paths, evaluate=evaluate, build_header=styled,
+        include_unmatched=include_unmatched and styled, measurement_maps=measurement_maps
+    )
+
+    outputs = {}
+    if 'csv' in formats:
+        outputs['csv'] = write_csv(merged_df, with_extension(output_file_path, 'csv'))
+    if 'parquet' in formats:
+        outputs['parquet'] = write_parquet(merged_df, with_extension(output_file_path, 'parquet'))
+    if not styled:
+        return outputs
+
     # Save the data to a temporary Excel file first
     # temp_output = output_file_path
     temp_output = output_file_path
-    logging.info(f"Writing to temporary file: {temp_output}")
+    # Per-output data file so concurrent merges (bulk jobs, several workers) never share it
+    data_file_path = f"{os.path.splitext(output_file_path)[0]}.data.xlsx"
+    logging.info(f"Writing to temporary file: {data_file_path}")
     logging.debug(f"Merged DataFrame preview:\n{merged_df.head()}")
-    merged_df.to_excel("data.xlsx", index=False)
-    # with pd.ExcelWriter(temp_output, engine='openpyxl') as writer:
-    #     logging.info(f"Writing merged data to temporary file: {temp_output}")
-    #     merged_df.to_excel(writer, sheet_name='Sheet 1', index=False)
-    #     if unmatched_data:
-    #         logging.info(f"Writing unmatched data to temporary file: {temp_output}")
-    #         pd.DataFrame(unmatched_data).to_excel(writer, sheet_name='unmatched', index=False)
+    merged_df.to_excel(data_file_path, index=False)
     
     # Merge the temporary file with the header file while preserving formatting
     try:
         logging.info("Merging temporary file with header file to preserve formatting.")
-        merge_excel_with_header("data.xlsx", header_file_path, temp_output,header_row_idx)
+        merge_excel_with_header(
+            data_file_path, header_file_path, temp_output, header_row_idx,
+            extra_sheets={'unmatched': unmatched_df, 'summary': summary_df}
+        )
         logging.info(f"Final formatted data saved to {temp_output}")
-    
+        outputs['xlsx'] = temp_output
+
     except Exception as e:
         logging.error(f"Failed to create excel file: {str(e)}")
+    finally:
+        if os.path.exists(data_file_path):
+            os.remove(data_file_path)
+    return outputs
 
 
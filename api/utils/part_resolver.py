@@ -0,0 +1,78 @@
+import os
+import re
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TEMPLATE_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+REPORT_NAME = "merged_report.xlsx"
+
+
+def _normalise_name(name, strip_serial=False):
+    """Comparable form of a file/folder name: 'Bonnet TC2' and 'BONNET TC2-1.PDF' both -> 'BONNETTC2'.
+
+    strip_serial also drops a trailing '_<n>' / ' <n>' / '-<n>' suffix ('901_17.TXT' -> '901').
+    """
+    stem = os.path.splitext(os.path.basename(name))[0].upper().strip()
+    stem = re.sub(r'[\s_-]+\d+$' if strip_serial else r'-\d+$', '', stem)
+    return re.sub(r'[^0-9A-Z]', '', stem)
+
+
+class PartResolver:
+    """Find the REPORT/<part>/ folder and template that a TXT file belongs to.
+
+    A TXT dropped into <watch_dir>/<part>/ belongs to that part. Otherwise its name is matched
+    against the part folder names and the files inside them (e.g. GROOVE.TXT -> REPORT/ATIS19,
+    which holds GROOVE.PDF).
+    """
+
+    def __init__(self, watch_dir, report_dir, report_name=REPORT_NAME):
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.report_dir = os.path.abspath(report_dir)
+        self.report_name = report_name
+        self._index = {}
+        self.refresh()
+
+    def refresh(self):
+        index = {}
+        for part in sorted(os.listdir(self.report_dir)):
+            part_dir = os.path.join(self.report_dir, part)
+            if not os.path.isdir(part_dir):
+                continue
+            index.setdefault(_normalise_name(part), part)
+            for name in os.listdir(part_dir):
+                index.setdefault(_normalise_name(name), part)
+        self._index = index
+
+    def part_for(self, txt_path):
+        rel_parts = os.path.relpath(os.path.abspath(txt_path), self.watch_dir).split(os.sep)
+        if len(rel_parts) > 1 and os.path.isdir(os.path.join(self.report_dir, rel_parts[0])):
+            return rel_parts[0]
+        return self.part_for_name(txt_path)
+
+    def part_for_name(self, name):
+        """Part folder matching a file or part name (a TXT, a template, or the folder name itself)."""
+        keys = (_normalise_name(name), _normalise_name(name, strip_serial=True))
+        if not any(k in self._index for k in keys):
+            self.refresh()
+        return next((self._index[k] for k in keys if k in self._index), None)
+
+    def template_for(self, part):
+        part_dir = os.path.join(self.report_dir, part)
+        report_stem = os.path.splitext(self.report_name)[0]
+        templates = sorted(
+            name for name in os.listdir(part_dir)
+            if name.lower().endswith(TEMPLATE_EXTENSIONS) and not name.startswith(report_stem) and not name.startswith('~$')
+        )
+        if not templates:
+            return None
+        if len(templates) > 1:
+            logging.warning(f"Several templates in {part_dir}, using {templates[0]}")
+        return os.path.join(part_dir, templates[0])
+
+    def report_for(self, part, day, seq=1):
+        """REPORT/<part>/merged_report_<day>.xlsx, or ..._<day>_<seq>.xlsx once a day's report is full."""
+        stem, ext = os.path.splitext(self.report_name)
+        suffix = f"_{day}" if seq == 1 else f"_{day}_{seq}"
+        return os.path.join(self.report_dir, part, f"{stem}{suffix}{ext}")
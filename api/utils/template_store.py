@@ -0,0 +1,207 @@
+import os
+import json
+import math
+import shutil
+import hashlib
+import logging
+import numbers
+import functools
+from datetime import datetime
+import numpy as np
+from api.utils.excel_extraction import extract_excel_data, remove_rows_after_index
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Bump when the stored layout changes so stale entries are never reused
+STORE_VERSION = 2
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Kept outside uploads/ (whose file names come from clients) and created private to this user
+STORE_DIR = os.environ.get("CONVERSION_TEMPLATE_STORE", os.path.join(BASE_DIR, ".cache", "templates"))
+
+META_FILE = "meta.json"
+HEADER_FILE = "header.xlsx"
+ARRAYS = ("kind", "num", "tidx", "text")
+
+# Cell kinds in the 'kind' array; the value itself is in 'num' or, via 'tidx', in 'text'.
+# KIND_MISSING marks a column that row does not have.
+KIND_MISSING = -1
+KIND_NAN, KIND_NONE, KIND_FLOAT, KIND_INT, KIND_BOOL, KIND_STR, KIND_DATETIME = range(7)
+
+
+def template_hash(file_path):
+    """Content hash of a template file; identical templates share one store entry."""
+    digest = hashlib.sha256(f"v{STORE_VERSION}:".encode())
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_dir(digest):
+    return os.path.join(STORE_DIR, digest)
+
+
+def _atomic_write(path, write):
+    """Write through a per-process temp file and rename, so other workers never see partial files."""
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _encode_cell(value, kinds, nums, tidx, texts, pos):
+    """Store one template value at pos of the kind/num/tidx arrays (strings go to texts)."""
+    kinds[pos] = KIND_NAN
+    if value is None:
+        kinds[pos] = KIND_NONE
+    elif isinstance(value, bool):
+        kinds[pos], nums[pos] = KIND_BOOL, float(value)
+    elif isinstance(value, numbers.Integral):
+        kinds[pos], nums[pos] = KIND_INT, float(value)
+    elif isinstance(value, numbers.Real):
+        kinds[pos] = KIND_NAN if math.isnan(value) else KIND_FLOAT
+        nums[pos] = float(value)
+    elif isinstance(value, datetime):
+        if value != value:  # NaT
+            return
+        kinds[pos], tidx[pos] = KIND_DATETIME, len(texts)
+        texts.append(value.isoformat())
+    else:
+        kinds[pos], tidx[pos] = KIND_STR, len(texts)
+        texts.append(str(value))
+
+
+def _encode(data_dict, header_row_idx):
+    """Lay out a parsed template as flat numpy arrays.
+
+    Column 0 of each table holds the Print No key, columns 1.. the template columns.
+    Every array is plain (no object dtype), so np.load(mmap_mode='r') maps it without copying.
+    """
+    columns = []
+    for row in data_dict.values():
+        for col in row:
+            if col not in columns:
+                columns.append(col)
+    shape = (len(data_dict), len(columns) + 1)
+    kinds = np.full(shape, KIND_MISSING, dtype=np.int8)
+    nums = np.full(shape, np.nan, dtype=np.float64)
+    tidx = np.full(shape, -1, dtype=np.int32)
+    texts = []
+    for r, (key, row) in enumerate(data_dict.items()):
+        _encode_cell(key, kinds, nums, tidx, texts, (r, 0))
+        for c, col in enumerate(columns, start=1):
+            if col in row:
+                _encode_cell(row[col], kinds, nums, tidx, texts, (r, c))
+    text = np.array(texts, dtype=str) if texts else np.array([], dtype='U1')
+    meta = {"version": STORE_VERSION, "header_row_idx": int(header_row_idx), "columns": [str(c) for c in columns]}
+    return meta, {"kind": kinds, "num": nums, "tidx": tidx, "text": text}
+
+
+def _decode_cell(kind, num, tidx, text):
+    if kind == KIND_NAN:
+        # A new object each time: blank Print No rows are distinct NaN keys, as when parsed
+        return float('nan')
+    if kind == KIND_NONE:
+        return None
+    if kind == KIND_FLOAT:
+        return num
+    if kind == KIND_INT:
+        return int(num)
+    if kind == KIND_BOOL:
+        return bool(num)
+    if kind == KIND_DATETIME:
+        return datetime.fromisoformat(str(text[tidx]))
+    return str(text[tidx])
+
+
+def _write_entry(entry_dir, meta, arrays):
+    for name in ARRAYS:
+        np.save(os.path.join(entry_dir, f"{name}.npy"), arrays[name], allow_pickle=False)
+    with open(os.path.join(entry_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def _build_entry(file_path, digest, build_header):
+    """Parse file_path and publish its entry directory in one rename."""
+    entry_dir = _entry_dir(digest)
+    tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        data_dict, _, header_row_idx = extract_excel_data(
+            file_path, build_header=build_header, header_file_path=os.path.join(tmp_dir, HEADER_FILE)
+        )
+        meta, arrays = _encode(data_dict, header_row_idx)
+        _write_entry(tmp_dir, meta, arrays)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another worker published the same template first; its entry is identical
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_entry(digest):
+    """Map a stored entry read-only. Only the mappings are cached; the data stays in the page cache,
+    shared by every worker, and is never copied into this process."""
+    entry_dir = _entry_dir(digest)
+    with open(os.path.join(entry_dir, META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode='r', allow_pickle=False)
+              for name in ARRAYS}
+    return meta, arrays
+
+
+def _materialise(meta, arrays):
+    """Build the {Print No: {column: value}} dict of one request from the mapped arrays."""
+    kinds, nums, tidx, text = arrays["kind"], arrays["num"], arrays["tidx"], arrays["text"]
+    columns = meta["columns"]
+    data_dict = {}
+    for r in range(kinds.shape[0]):
+        k_row, n_row, t_row = kinds[r].tolist(), nums[r].tolist(), tidx[r].tolist()
+        key = _decode_cell(k_row[0], n_row[0], t_row[0], text)
+        data_dict[key] = {
+            col: _decode_cell(k_row[c], n_row[c], t_row[c], text)
+            for c, col in enumerate(columns, start=1) if k_row[c] != KIND_MISSING
+        }
+    return data_dict
+
+
+def load_template(file_path, build_header=True):
+    """Return extract_excel_data() results for file_path, parsing each distinct template once.
+
+    Parsed templates (Print No index and column model as numpy arrays, header row index) are kept
+    in STORE_DIR/<content hash>/ together with the trimmed header workbook used for styling.
+    Every uvicorn worker maps the same files, so a template parsed by one worker is reused by all.
+
+    Returns:
+        (data_dict, header_file_path, header_row_idx) -- header_file_path is None unless build_header.
+    """
+    os.makedirs(STORE_DIR, mode=0o700, exist_ok=True)
+    digest = template_hash(file_path)
+    entry_dir = _entry_dir(digest)
+    header_path = os.path.join(entry_dir, HEADER_FILE)
+
+    if not os.path.exists(os.path.join(entry_dir, META_FILE)):
+        logging.info(f"Template store miss for {file_path} ({digest[:12]}); parsing")
+        _build_entry(file_path, digest, build_header)
+    else:
+        logging.info(f"Template store hit for {file_path} ({digest[:12]})")
+
+    meta, arrays = _load_entry(digest)
+    header_row_idx = meta["header_row_idx"]
+
+    if build_header and not os.path.exists(header_path):
+        # Entry was first stored by a data-only (CSV/Parquet) request
+        _atomic_write(header_path, lambda path: remove_rows_after_index(file_path, path, header_row_idx))
+
+    # A fresh dict per call: callers normalise and extend the rows in place
+    return _materialise(meta, arrays), (header_path if build_header else None), header_row_idx
+
@@ -0,0 +1,130 @@
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Columns appended to the merged table by add_tolerance_columns (in output order)
+EVALUATION_COLUMNS = ['MIN', 'MAX', 'MEAN', 'STD DEV', 'MAX DEVIATION', 'CP', 'CPK', 'NG COUNT', 'RESULT']
+
+
+def measured_columns(df):
+    """Return the MEASURED / MEASURED-N column names of df, in table order."""
+    return [col for col in df.columns if str(col).strip().upper().startswith("MEASURED")]
+
+
+def _to_float_array(values):
+    """Coerce a sequence (possibly holding '' / None / strings) to a float ndarray with NaN gaps."""
+    return pd.to_numeric(pd.Series(list(values), dtype=object), errors='coerce').to_numpy(dtype=float)
+
+
+def evaluate_tolerances(measured, nominal, lower, upper):
+    """Evaluate a (dims x serials) matrix of measurements against per-dimension limits.
+
+    All statistics are computed column-wise with NumPy, so the cost does not grow with a
+    Python loop over rows or serials. NaN marks a missing measurement / limit and is ignored.
+
+    Args:
+        measured: 2-D array-like, one row per Print No and one column per MEASURED-N.
+        nominal, lower, upper: 1-D array-likes aligned with the rows of measured.
+
+    Returns:
+        dict of 1-D arrays keyed by the names in EVALUATION_COLUMNS plus 'N'.
+    """
+    measured = np.asarray(measured, dtype=float)
+    if measured.ndim == 1:
+        measured = measured.reshape(-1, 1)
+    if measured.shape[1] == 0:
+        # No MEASURED columns at all: evaluate a single empty serial
+        measured = np.full((measured.shape[0], 1), np.nan)
+    nominal = np.asarray(nominal, dtype=float)
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+
+    valid = ~np.isnan(measured)
+    count = valid.sum(axis=1)
+
+    # Rows without any measurement legitimately produce all-NaN slices; keep the log clean.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mins = np.nanmin(measured, axis=1)
+        maxs = np.nanmax(measured, axis=1)
+        means = np.nanmean(measured, axis=1)
+        stds = np.nanstd(measured, axis=1, ddof=1)
+    stds = np.where(count > 1, stds, np.nan)
+
+    # Worst deviation from nominal across all serials (signed, largest magnitude)
+    deviation = measured - nominal[:, None]
+    abs_dev = np.where(valid, np.abs(deviation), -np.inf)
+    worst_idx = np.argmax(abs_dev, axis=1)
+    max_deviation = np.take_along_axis(deviation, worst_idx[:, None], axis=1)[:, 0]
+    max_deviation = np.where(count > 0, max_deviation, np.nan)
+
+    # Pass/fail per serial; a missing limit never fails a measurement
+    with np.errstate(invalid='ignore'):
+        below = valid & ~np.isnan(lower)[:, None] & (measured < lower[:, None])
+        above = valid & ~np.isnan(upper)[:, None] & (measured > upper[:, None])
+    ng_count = (below | above).sum(axis=1)
+
+    # Process capability needs both limits and a non-zero spread
+    with np.errstate(divide='ignore', invalid='ignore'):
+        usable = (count > 1) & (stds > 0) & ~np.isnan(lower) & ~np.isnan(upper)
+        cp = np.where(usable, (upper - lower) / (6 * stds), np.nan)
+        cpk = np.where(usable, np.minimum(upper - means, means - lower) / (3 * stds), np.nan)
+
+    result = np.where(count == 0, None, np.where(ng_count > 0, 'NG', 'OK'))
+
+    return {
+        'N': count,
+        'MIN': mins,
+        'MAX': maxs,
+        'MEAN': means,
+        'STD DEV': stds,
+        'MAX DEVIATION': max_deviation,
+        'CP': cp,
+        'CPK': cpk,
+        'NG COUNT': np.where(count > 0, ng_count, np.nan),
+        'RESULT': result,
+    }
+
+
+def add_tolerance_columns(df, nominal, lower, upper, keys=None):
+    """Append evaluation columns to df and build a per-dimension summary table.
+
+    Args:
+        df: merged DataFrame holding MEASURED / MEASURED-N columns.
+        nominal, lower, upper: per-row values aligned with df ('' / None / strings become NaN).
+        keys: optional Print No per row, used to label the summary rows.
+
+    Returns:
+        (df with EVALUATION_COLUMNS appended, summary DataFrame)
+    """
+    nominal, lower, upper = (_to_float_array(v) for v in (nominal, lower, upper))
+    cols = measured_columns(df)
+    measured = df[cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float) if cols \
+        else np.empty((len(df), 0))
+    logging.info(f"Evaluating tolerances for {measured.shape[0]} dimensions x {measured.shape[1]} measurements")
+
+    stats = evaluate_tolerances(measured, nominal, lower, upper)
+
+    df = df.copy()
+    for name in EVALUATION_COLUMNS:
+        df[name] = stats[name]
+    # e.g. CP/CPK stay empty with a single serial; don't add blank columns to the report
+    empty_cols = [name for name in EVALUATION_COLUMNS if df[name].isna().all()]
+    if empty_cols:
+        df.drop(columns=empty_cols, inplace=True)
+
+    summary = pd.DataFrame({
+        'PRINT NO': list(keys) if keys is not None else np.arange(1, len(df) + 1),
+        'NOMINAL': np.asarray(nominal, dtype=float),
+        'LSL': np.asarray(lower, dtype=float),
+        'USL': np.asarray(upper, dtype=float),
+        'N': stats['N'],
+        **{name: stats[name] for name in EVALUATION_COLUMNS},
+    })
+    # Only dimensions that were actually measured belong in the summary
+    summary = summary[summary['N'] > 0].reset_index(drop=True)
+    return df, summary
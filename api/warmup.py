@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import logging
+import importlib
+import subprocess
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Modules that are deliberately not imported by api.main; they are loaded on the first
+# merge request, or ahead of time by preload() when CONVERSION_PRELOAD is enabled.
+HEAVY_MODULES = [
+    "numpy",
+    "pandas",
+    "openpyxl",
+    "chardet",
+    "api.services.merge_service",
+]
+
+
+def preload_enabled():
+    """True when the CONVERSION_PRELOAD environment variable asks for a warm-up."""
+    return os.environ.get("CONVERSION_PRELOAD", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def preload(modules=None):
+    """Import the heavy modules now so the first request does not pay for them."""
+    start = time.perf_counter()
+    for name in modules or HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logging.warning(f"Warm-up could not import {name}: {str(e)}")
+    logging.info(f"Warm-up imports finished in {time.perf_counter() - start:.3f}s")
+
+
+def start_background_preload():
+    """Run preload() in a daemon thread so the worker reports ready without waiting for it."""
+    thread = threading.Thread(target=preload, name="conversion-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def _time_import(statement, runs):
+    """Best-of-runs wall time for executing statement in a fresh interpreter."""
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import logging; logging.disable(logging.CRITICAL); " + statement],
+                       cwd=base_dir, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(runs=5):
+    """Compare cold import time of the app against importing the full merge stack."""
+    app_only = _time_import("import api.main", runs)
+    full = _time_import("import api.main, api.warmup; api.warmup.preload()", runs)
+    print(f"import api.main (lazy):          {app_only:.3f}s")
+    print(f"import api.main + heavy modules: {full:.3f}s")
+    return app_only, full
+
+
+if __name__ == "__main__":
+    # Import-time benchmark: python -m api.warmup [runs]
+    logging.disable(logging.CRITICAL)
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)